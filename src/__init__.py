@@ -1 +1,5 @@
+import os
+
 SOURCE = "pubmed"
+# corpora served by the app, e.g. PUBVIS_SOURCES=pubmed,arxiv; the first one is also served without a route prefix
+SOURCES = [s.strip() for s in os.environ.get("PUBVIS_SOURCES", SOURCE).split(",") if s.strip()]
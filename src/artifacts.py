@@ -0,0 +1,53 @@
+import datetime
+import json
+import os
+import shutil
+
+# setup_db writes every build of a corpus into its own folder assets/{source}/versions/{version}/ and then
+# atomically replaces assets/{source}/manifest.json, which points the running app to the new version
+
+
+def manifest_path(source: str) -> str:
+    return f"assets/{source}/manifest.json"
+
+
+def version_dir(source: str, version: str | None) -> str:
+    # without a manifest, the artifacts are expected directly in assets/{source} (layout before versioning)
+    return f"assets/{source}/versions/{version}" if version else f"assets/{source}"
+
+
+def build_dir(source: str, version: str) -> str:
+    # versions are built outside of versions/ and only moved there once complete, i.e., failed builds are never pruned as versions
+    return f"assets/{source}/build-{version}"
+
+
+def read_manifest(source: str) -> dict[str, str] | None:
+    """Read the manifest pointing to the currently active version of a corpus' artifacts (if it exists)"""
+    try:
+        with open(manifest_path(source)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(source: str, version: str):
+    """Atomically switch the active version of a corpus' artifacts to the given version"""
+    manifest = {"version": version, "created": datetime.datetime.now(tz=datetime.UTC).isoformat()}
+    tmp_path = f"{manifest_path(source)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path(source))
+
+
+def prune_versions(source: str, keep: int = 3) -> list[str]:
+    """Delete all but the newest `keep` versions (older ones might still be in use by apps that are draining them)"""
+    versions_root = f"assets/{source}/versions"
+    if not os.path.isdir(versions_root):
+        return []
+    manifest = read_manifest(source) or {}
+    # version names are timestamps, i.e., sorting them by name sorts them by age
+    versions = sorted(os.listdir(versions_root))
+    removed = [v for v in versions[: max(len(versions) - keep, 0)] if v != manifest.get("version")]
+    for version in removed:
+        shutil.rmtree(version_dir(source, version))
+    return removed
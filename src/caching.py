@@ -0,0 +1,59 @@
+import hashlib
+import os
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from src.corpus import CorpusVersion, get_corpus_version
+
+# how long (in seconds) browsers and CDNs may reuse responses derived from the corpus before revalidating them
+CACHE_MAX_AGE = int(os.environ.get("PUBVIS_CACHE_MAX_AGE", "600"))
+
+PUBLIC = f"public, max-age={CACHE_MAX_AGE}"
+PRIVATE = "private, no-cache"
+NO_STORE = "no-store"
+
+
+def make_etag(build_id: str, request: Request) -> str:
+    # responses only depend on the build of the corpus and the requested URL (incl. item_id and query parameters)
+    key = f"{build_id}|{request.url.path}|{request.url.query}"
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # weak comparison, i.e., ignore W/ prefixes; If-Modified-Since is ignored if If-None-Match is given.
+        # "*" is not supported, since this is checked before the route knows whether the resource exists
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_policy(cache_control: str, validate: bool = True):
+    """
+    Create a dependency setting the Cache-Control header of a route
+
+    With `validate`, the response additionally gets an ETag and Last-Modified header derived from the
+    build of the corpus; conditional requests with matching validators are answered with 304 Not Modified
+    before the route itself is executed. The dependency returns the headers for routes returning their
+    own Response object (e.g. FileResponse).
+    """
+
+    def dependency(request: Request, response: Response, version: CorpusVersion = Depends(get_corpus_version)):
+        headers = {"Cache-Control": cache_control}
+        if validate and version.build_id is not None and version.last_modified is not None:
+            headers["ETag"] = make_etag(version.build_id, request)
+            headers["Last-Modified"] = format_datetime(version.last_modified, usegmt=True)
+            if is_not_modified(request, headers["ETag"], headers["Last-Modified"]):
+                raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return headers
+
+    return dependency
@@ -0,0 +1,237 @@
+import datetime
+import logging
+import os
+import sys
+import threading
+from typing import Any
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from fastapi import Depends, HTTPException, Request
+
+from src import SOURCES
+from src.artifacts import read_manifest, version_dir
+from src.db import get_binds, get_engine, get_users_engine
+
+# load the vectorizer and NN index of all corpora at startup instead of on their first request
+PRELOAD_CORPORA = os.environ.get("PUBVIS_PRELOAD", "0") == "1"
+# how often (in seconds) to check the manifests for new versions created by setup_db (0 to disable hot reloading)
+RELOAD_INTERVAL = float(os.environ.get("PUBVIS_RELOAD_INTERVAL", "10"))
+
+
+def estimate_nbytes(obj: Any, _seen: set[int] | None = None) -> int:
+    """Rough estimate of the memory held by a (fitted) sklearn object, counting arrays, dicts and lists"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if sp.issparse(obj):
+        return sum(
+            estimate_nbytes(getattr(obj, a), _seen) for a in ("data", "indices", "indptr", "row", "col") if hasattr(obj, a)
+        )
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(k, _seen) + estimate_nbytes(v, _seen) for k, v in obj.items())
+    if isinstance(obj, list | tuple | set | frozenset):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(v, _seen) for v in obj)
+    if hasattr(obj, "__dict__") and not isinstance(obj, type):
+        return sys.getsizeof(obj) + estimate_nbytes(vars(obj), _seen)
+    return sys.getsizeof(obj)
+
+
+class CorpusVersion:
+    """
+    One (immutable) build of a corpus: items DB, vectorizer, nearest neighbors index and map jsons
+
+    The vectorizer and NN index are loaded on first access (or at startup with PUBVIS_PRELOAD=1).
+    Requests hold a reference to the version they started with, so after a newer version was
+    swapped in, the old one is only closed once all of its requests have finished (drained).
+    """
+
+    def __init__(self, source: str, version: str | None = None, created: str | None = None, users_engine=None):
+        self.source = source
+        self.version = version
+        self.created = created
+        self.asset_dir = version_dir(source, version)
+        self.engine = get_engine(self.asset_dir)
+        # users and ratings are shared by all versions, i.e., ratings given while a version drains are kept
+        self.binds = get_binds(self.engine, users_engine or get_users_engine(source))
+        self.last_modified = self._get_last_modified()
+        self._artifacts: dict[str, Any] = {}
+        self._nbytes: dict[str, int] = {}
+        # loading an artifact can take a while, so it has its own lock and doesn't block acquiring this version
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._refcount = 0
+        self._retired = False
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.asset_dir, filename)
+
+    def _get_last_modified(self) -> datetime.datetime | None:
+        if self.created:
+            return datetime.datetime.fromisoformat(self.created)
+        # without a manifest, fall back on the time the DB was created (if it exists)
+        if os.path.exists(self.path("database.db")):
+            return datetime.datetime.fromtimestamp(os.path.getmtime(self.path("database.db")), tz=datetime.UTC)
+        return None
+
+    @property
+    def build_id(self) -> str | None:
+        """Identifies the build of the artifacts; responses derived from them only change when it changes"""
+        if self.last_modified is None:
+            return None
+        return f"{self.source}/{self.version}/{self.last_modified.isoformat()}"
+
+    def _get_artifact(self, name: str):
+        if name not in self._artifacts:
+            with self._load_lock:
+                # check again, another thread might have loaded it while we were waiting for the lock
+                if name not in self._artifacts:
+                    artifact = joblib.load(self.path(f"{name}.pkl"))
+                    self._nbytes[name] = estimate_nbytes(artifact)
+                    self._artifacts[name] = artifact
+                    logging.info(
+                        f"[corpus {self.source}]: loaded {name} of version {self.version} (~{self._nbytes[name] / 2**20:.1f} MiB)"
+                    )
+        return self._artifacts[name]
+
+    @property
+    def vectorizer(self):
+        return self._get_artifact("vectorizer")
+
+    @property
+    def nn_tree(self):
+        return self._get_artifact("nn_tree")
+
+    def load(self):
+        self._get_artifact("vectorizer")
+        self._get_artifact("nn_tree")
+        # open a first DB connection so the pool is warm as well
+        with self.engine.connect():
+            pass
+
+    def acquire(self):
+        with self._lock:
+            self._refcount += 1
+
+    def release(self):
+        with self._lock:
+            self._refcount -= 1
+            drained = self._retired and not self._refcount
+        if drained:
+            self._close()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            drained = not self._refcount
+        if drained:
+            self._close()
+
+    def _close(self):
+        self.engine.dispose()
+        self._artifacts.clear()
+        self._nbytes.clear()
+        logging.info(f"[corpus {self.source}]: drained and closed version {self.version}")
+
+    def info(self) -> dict[str, Any]:
+        return {
+            "source": self.source,
+            "version": self.version,
+            "created": self.created,
+            "loaded": sorted(self._artifacts),
+            "memory_bytes": dict(self._nbytes),
+            "total_memory_bytes": sum(self._nbytes.values()),
+        }
+
+
+class Corpus:
+    """A collection of texts, served from the version of its artifacts the manifest points to"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.users_engine = get_users_engine(source)
+        manifest = read_manifest(source) or {}
+        self.current = CorpusVersion(source, manifest.get("version"), manifest.get("created"), self.users_engine)
+        self._failed_version: str | None = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> CorpusVersion:
+        """Get the current version; it stays usable until it is released again, even if a newer one is swapped in"""
+        with self._lock:
+            version = self.current
+            version.acquire()
+        return version
+
+    def load(self):
+        self.current.load()
+
+    def reload_if_changed(self) -> bool:
+        """Load the version the manifest points to (if it is new) and swap it in once it is ready"""
+        manifest = read_manifest(self.source)
+        if not manifest or manifest["version"] in (self.current.version, self._failed_version):
+            return False
+        logging.info(f"[corpus {self.source}]: loading new version {manifest['version']}")
+        new_version = CorpusVersion(self.source, manifest["version"], manifest.get("created"), self.users_engine)
+        try:
+            new_version.load()
+        except Exception:
+            # keep serving the current version and don't retry until the manifest changes again
+            logging.exception(f"[corpus {self.source}]: failed to load version {manifest['version']}")
+            self._failed_version = manifest["version"]
+            new_version.retire()
+            return False
+        with self._lock:
+            old_version, self.current = self.current, new_version
+        old_version.retire()
+        logging.info(f"[corpus {self.source}]: switched from version {old_version.version} to {new_version.version}")
+        return True
+
+    def info(self) -> dict[str, Any]:
+        return self.current.info()
+
+
+class ManifestWatcher(threading.Thread):
+    """Background thread periodically checking the manifests of all corpora for new versions"""
+
+    def __init__(self, corpora: list[Corpus], interval: float = RELOAD_INTERVAL):
+        super().__init__(name="pubvis-manifest-watcher", daemon=True)
+        self.corpora = corpora
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for corpus in self.corpora:
+                try:
+                    corpus.reload_if_changed()
+                except Exception:
+                    logging.exception(f"[corpus {corpus.source}]: checking for a new version failed")
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+CORPORA = {source: Corpus(source) for source in SOURCES}
+
+
+def get_corpus(request: Request) -> Corpus:
+    # routes under /corpora/{source} select the corpus, all other routes use the default (first) corpus
+    source = request.path_params.get("source", SOURCES[0])
+    if source not in CORPORA:
+        raise HTTPException(status_code=404, detail="Corpus not found")
+    return CORPORA[source]
+
+
+def get_corpus_version(corpus: Corpus = Depends(get_corpus)):
+    # all dependencies of a request share the same version, so DB, vectorizer and NN index always match
+    version = corpus.acquire()
+    try:
+        yield version
+    finally:
+        version.release()
@@ -1,14 +1,17 @@
 import datetime
 import os
 
-from sqlmodel import Field, Relationship, SQLModel, create_engine
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.schema import DropConstraint
+from sqlmodel import Field, Relationship, Session, SQLModel, create_engine, select
 
-from src import SOURCE
+from src import SOURCE, SOURCES
 
 
 class Rating(SQLModel, table=True):
     user_id: str = Field(primary_key=True, foreign_key="user.user_id")
-    item_id: str = Field(primary_key=True, foreign_key="item.item_id")
+    # no foreign key to item.item_id, since ratings are stored in a different DB than the items
+    item_id: str = Field(primary_key=True)
     rating: float
     timestamp: datetime.datetime = datetime.datetime.now(tz=datetime.UTC)
 
@@ -38,10 +41,94 @@ class Item(SQLModel, table=True):
     )
 
 
-SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL") or f"sqlite:///assets/{SOURCE}/database.db"
+# items (incl. their similarities) are part of a build of the corpus and stored in a SQLite DB next to the other
+# artifacts, while users and their ratings are kept in a separate DB that is shared by all builds of the corpus
+ITEM_TABLES = ("item", "similarity")
+USER_TABLES = ("user", "rating")
+
+
+def get_engine(asset_dir: str):
+    return create_engine(f"sqlite:///{asset_dir}/database.db", echo=False)
+
+
+def get_users_database_url(source: str = SOURCE) -> str:
+    # DATABASE_URL_<SOURCE> configures the users DB of a specific corpus, DATABASE_URL that of the default corpus
+    url = os.environ.get(f"DATABASE_URL_{source.upper()}")
+    if not url and source == SOURCES[0]:
+        url = os.environ.get("DATABASE_URL")
+    return url or f"sqlite:///assets/{source}/users.db"
+
+
+def get_users_engine(source: str = SOURCE):
+    return create_engine(get_users_database_url(source), echo=False)
+
+
+def get_binds(engine, users_engine) -> dict:
+    """Session binds routing the item models to the DB of a build and the user models to the shared users DB"""
+    return {Item: engine, Similarity: engine, User: users_engine, Rating: users_engine}
+
+
+def create_items_db(engine):
+    SQLModel.metadata.create_all(engine, tables=[SQLModel.metadata.tables[t] for t in ITEM_TABLES])
+
+
+def create_users_db(users_engine, source: str = SOURCE):
+    """
+    Create the users DB if it does not exist yet
+
+    A new users DB takes over the users and ratings from assets/{source}/database.db,
+    where they were stored together with the items before the DBs were split.
+    """
+    os.makedirs(f"assets/{source}", exist_ok=True)
+    is_new = not inspect(users_engine).has_table("user")
+    SQLModel.metadata.create_all(users_engine, tables=[SQLModel.metadata.tables[t] for t in USER_TABLES])
+    if not is_new:
+        _drop_rating_item_fk(users_engine)
+    legacy_path = f"assets/{source}/database.db"
+    if not is_new or not os.path.exists(legacy_path):
+        return
+    legacy_engine = create_engine(f"sqlite:///{legacy_path}", echo=False)
+    if inspect(legacy_engine).has_table("rating"):
+        with Session(legacy_engine) as legacy_session, Session(users_engine) as session:
+            session.add_all([User(user_id=u.user_id) for u in legacy_session.exec(select(User))])
+            session.add_all(
+                [
+                    Rating(user_id=r.user_id, item_id=r.item_id, rating=r.rating, timestamp=r.timestamp)
+                    for r in legacy_session.exec(select(Rating))
+                ]
+            )
+            session.commit()
+    legacy_engine.dispose()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False)
 
+def _drop_rating_item_fk(users_engine):
+    """
+    Remove the foreign key rating.item_id -> item.item_id from users DBs created before the DBs were split
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    Otherwise, ratings for items that were only added in a newer build (and are therefore
+    missing in the item table of this DB) would be rejected by DBs enforcing foreign keys.
+    """
+    if not any(fk["referred_table"] == "item" for fk in inspect(users_engine).get_foreign_keys("rating")):
+        return
+    with users_engine.begin() as conn:
+        if users_engine.dialect.name == "sqlite":
+            # SQLite can't drop constraints, so the table is recreated without it
+            conn.execute(text("ALTER TABLE rating RENAME TO rating_legacy"))
+            SQLModel.metadata.tables["rating"].create(conn)
+            conn.execute(
+                text(
+                    "INSERT INTO rating (user_id, item_id, rating, timestamp) "
+                    "SELECT user_id, item_id, rating, timestamp FROM rating_legacy"
+                )
+            )
+            conn.execute(text("DROP TABLE rating_legacy"))
+            return
+        rating = Table("rating", MetaData(), autoload_with=conn)
+        for constraint in rating.foreign_key_constraints:
+            if constraint.referred_table.name == "item":
+                if constraint.name is None:
+                    raise RuntimeError(
+                        f"The rating table of the users DB {users_engine.url!r} still has an unnamed foreign key to the "
+                        "item table, which rejects ratings for new items; please drop it manually."
+                    )
+                conn.execute(DropConstraint(constraint))
@@ -1,18 +1,39 @@
-import joblib
-from fastapi import Depends, FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from sqlalchemy import func
 from sqlmodel import Session, col, or_, select
 
-from src import SOURCE
-from src.db import Item, Rating, User, engine
+from src import metrics
+from src.caching import NO_STORE, PRIVATE, PUBLIC, cache_policy
+from src.corpus import CORPORA, PRELOAD_CORPORA, RELOAD_INTERVAL, CorpusVersion, ManifestWatcher, get_corpus, get_corpus_version
+from src.db import Item, Rating, User, create_users_db
+from src.metrics import timed
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for corpus in CORPORA.values():
+        create_users_db(corpus.users_engine, corpus.source)
+    if PRELOAD_CORPORA:
+        for corpus in CORPORA.values():
+            corpus.load()
+    # pick up new versions of the artifacts created by setup_db without a restart
+    watcher = ManifestWatcher(list(CORPORA.values()), RELOAD_INTERVAL) if RELOAD_INTERVAL > 0 else None
+    if watcher:
+        watcher.start()
+    yield
+    if watcher:
+        watcher.stop()
 
-VECTORIZER = None
-NN_TREE = None
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+# all item/user routes are served for the default corpus at / and for every corpus at /corpora/{source}/
+router = APIRouter()
 
 
 # models for incoming and outgoing data
@@ -51,23 +72,17 @@ class SimilaritySearchRequestBody(BaseModel):
 
 
 # dependencies
-def get_session():
-    with Session(engine) as session:
+def get_session(version: CorpusVersion = Depends(get_corpus_version)):
+    with Session(binds=version.binds) as session:
         yield session
 
 
-def get_vectorizer():
-    global VECTORIZER
-    if VECTORIZER is None:
-        VECTORIZER = joblib.load(f"assets/{SOURCE}/vectorizer.pkl")
-    yield VECTORIZER
+def get_vectorizer(version: CorpusVersion = Depends(get_corpus_version)):
+    yield version.vectorizer
 
 
-def get_nn_tree():
-    global NN_TREE
-    if NN_TREE is None:
-        NN_TREE = joblib.load(f"assets/{SOURCE}/nn_tree.pkl")
-    yield NN_TREE
+def get_nn_tree(version: CorpusVersion = Depends(get_corpus_version)):
+    yield version.nn_tree
 
 
 @app.get("/health", include_in_schema=False)
@@ -75,17 +90,40 @@ def get_health():
     return "alive"
 
 
-@app.get("/static_json_item_info", include_in_schema=False)
-async def precomputed_item_info_json():
-    return FileResponse(f"assets/{SOURCE}/item_info.json")
+@app.get("/metrics", include_in_schema=False, response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Request latency, DB query and processing stage histograms in the Prometheus text format
+    (only available if the app was started with PUBVIS_METRICS=1)
+    """
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return metrics.render_metrics()
 
 
-@app.get("/static_json_xyc", include_in_schema=False)
-async def precomputed_xyc_json():
-    return FileResponse(f"assets/{SOURCE}/xyc.json")
+@app.get("/corpora")
+def list_corpora():
+    """
+    List all corpora served by this app with their current version, loaded artifacts and (approximate) memory usage
+    """
+    return [corpus.info() for corpus in CORPORA.values()]
 
 
-@app.get("/items/random", response_model=list[ItemViewModel])
+@router.get("/static_json_item_info", include_in_schema=False)
+async def precomputed_item_info_json(
+    version: CorpusVersion = Depends(get_corpus_version), headers: dict[str, str] = Depends(cache_policy(PUBLIC))
+):
+    return FileResponse(version.path("item_info.json"), headers=headers)
+
+
+@router.get("/static_json_xyc", include_in_schema=False)
+async def precomputed_xyc_json(
+    version: CorpusVersion = Depends(get_corpus_version), headers: dict[str, str] = Depends(cache_policy(PUBLIC))
+):
+    return FileResponse(version.path("xyc.json"), headers=headers)
+
+
+@router.get("/items/random", response_model=list[ItemViewModel], dependencies=[Depends(cache_policy(NO_STORE, validate=False))])
 def get_random(n: int = 20, session: Session = Depends(get_session)):
     """
     Get a random selection of items
@@ -97,7 +135,7 @@ def get_random(n: int = 20, session: Session = Depends(get_session)):
     return [ItemViewModel.from_item(item) for item in items]
 
 
-@app.get("/items/search", response_model=list[ItemViewModel])
+@router.get("/items/search", response_model=list[ItemViewModel], dependencies=[Depends(cache_policy(PUBLIC))])
 def keyword_search(q: str, n: int = 20, session: Session = Depends(get_session)):
     """
     Quick keyword search on title and authors of items
@@ -115,7 +153,7 @@ def keyword_search(q: str, n: int = 20, session: Session = Depends(get_session))
     return [ItemViewModel.from_item(item) for item in items]
 
 
-@app.post("/items/similar", response_model=list[ItemViewModel])
+@router.post("/items/similar", response_model=list[ItemViewModel])
 def similarity_search(
     search_body: SimilaritySearchRequestBody,
     session: Session = Depends(get_session),
@@ -129,16 +167,19 @@ def similarity_search(
         - q: item full text for search (mandatory!)
         - n: number of items to return (default: 20)
     """
-    X = vectorizer.transform([search_body.q])
-    nn_distances, nn_idx = nn_tree.kneighbors(X)
-    return [
-        ItemViewModel.from_item(session.get(Item, nn_tree.item_ids_[j]), 100 * (1 - nn_distances[0, i]))
-        for i, j in enumerate(nn_idx[0, : search_body.n])
-        if nn_distances[0, i] < 1
-    ]
-
-
-@app.get("/items/{item_id}", response_model=ItemViewModel)
+    with timed("vectorize"):
+        X = vectorizer.transform([search_body.q])
+    with timed("knn"):
+        nn_distances, nn_idx = nn_tree.kneighbors(X)
+    with timed("hydrate"):
+        return [
+            ItemViewModel.from_item(session.get(Item, nn_tree.item_ids_[j]), 100 * (1 - nn_distances[0, i]))
+            for i, j in enumerate(nn_idx[0, : search_body.n])
+            if nn_distances[0, i] < 1
+        ]
+
+
+@router.get("/items/{item_id}", response_model=ItemViewModel, dependencies=[Depends(cache_policy(PUBLIC))])
 def get_item_details(item_id: str, session: Session = Depends(get_session)):
     """
     Get details for a given item
@@ -151,7 +192,7 @@ def get_item_details(item_id: str, session: Session = Depends(get_session)):
     return ItemViewModel.from_item(item, shorten_authors=False)
 
 
-@app.get("/items/{item_id}/similar", response_model=list[ItemViewModel])
+@router.get("/items/{item_id}/similar", response_model=list[ItemViewModel], dependencies=[Depends(cache_policy(PUBLIC))])
 def get_similar(item_id: str, n: int = 20, session: Session = Depends(get_session)):
     """
     Get items similar to this one
@@ -162,10 +203,16 @@ def get_similar(item_id: str, n: int = 20, session: Session = Depends(get_sessio
     item = session.get(Item, item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    return [ItemViewModel.from_item(session.get(Item, r.item_id2), r.simscore) for r in item.similar_items]
+    with timed("hydrate"):
+        return [ItemViewModel.from_item(session.get(Item, r.item_id2), r.simscore) for r in item.similar_items]
 
 
-@app.get("/users/{user_id}/recommendations", response_model=list[ItemViewModel])
+@router.get(
+    "/users/{user_id}/recommendations",
+    response_model=list[ItemViewModel],
+    # personalized and changes with every rating
+    dependencies=[Depends(cache_policy(PRIVATE, validate=False))],
+)
 def get_recommendations(user_id: str, n: int = 20, session: Session = Depends(get_session)):
     """
     Get personal item recommendations for the user;
@@ -184,16 +231,21 @@ def get_recommendations(user_id: str, n: int = 20, session: Session = Depends(ge
     # extract all the similar items for the rated items and combine their similarity scores by taking the max
     # but exclude items the user has previously rated
     similar_items_dict: dict[str, float] = {}
-    for item_id in rated_items:
-        item = session.get(Item, item_id)
-        for s in item.similar_items:
-            if s.item_id2 not in rated_items_all:
-                similar_items_dict[s.item_id2] = max(similar_items_dict.get(s.item_id2, 0), s.simscore)
+    with timed("aggregate"):
+        for item_id in rated_items:
+            item = session.get(Item, item_id)
+            # ratings are kept across rebuilds of the corpus, so the item might not exist anymore
+            if not item:
+                continue
+            for s in item.similar_items:
+                if s.item_id2 not in rated_items_all:
+                    similar_items_dict[s.item_id2] = max(similar_items_dict.get(s.item_id2, 0), s.simscore)
     # limit results to n
     similar_item_ids = sorted(similar_items_dict, key=similar_items_dict.get, reverse=True)[:n]
-    similar_items = [
-        ItemViewModel.from_item(session.get(Item, item_id), similar_items_dict[item_id]) for item_id in similar_item_ids
-    ]
+    with timed("hydrate"):
+        similar_items = [
+            ItemViewModel.from_item(session.get(Item, item_id), similar_items_dict[item_id]) for item_id in similar_item_ids
+        ]
 
     # return random items if there are no similar items for any reasons (e.g., no positive ratings)
     if not similar_items:
@@ -201,7 +253,7 @@ def get_recommendations(user_id: str, n: int = 20, session: Session = Depends(ge
     return similar_items
 
 
-@app.post("/ratings")
+@router.post("/ratings")
 def add_rating(rating_body: RatingRequestBody, session: Session = Depends(get_session)):
     """
     Create or update the rating for an item for a user
@@ -230,4 +282,6 @@ def add_rating(rating_body: RatingRequestBody, session: Session = Depends(get_se
     session.commit()
 
 
+app.include_router(router)
+app.include_router(router, prefix="/corpora/{source}", dependencies=[Depends(get_corpus)])
 app.mount("/", StaticFiles(directory="frontend/dist", html=True))
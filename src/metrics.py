@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# instrumentation is opt-in: set PUBVIS_METRICS=1 to record histograms and expose them at /metrics
+METRICS_ENABLED = os.environ.get("PUBVIS_METRICS", "0") == "1"
+# additionally add X-Query-Count and Server-Timing headers to every response
+TIMING_HEADERS = os.environ.get("PUBVIS_TIMING_HEADERS", "0") == "1"
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Minimal thread-safe histogram with labels, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts: dict[tuple[str, ...], list[int]] = defaultdict(lambda: [0] * len(self.buckets))
+        self._sums: dict[tuple[str, ...], float] = defaultdict(float)
+        self._totals: dict[tuple[str, ...], int] = defaultdict(int)
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            counts = self._counts[labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[labels] += value
+            self._totals[labels] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._sums.clear()
+            self._totals.clear()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels in sorted(self._totals):
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels, strict=True))
+                sep = "," if label_str else ""
+                for bound, count in zip(self.buckets, self._counts[labels], strict=True):
+                    lines.append(f'{self.name}_bucket{{{label_str}{sep}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label_str}{sep}le="+Inf"}} {self._totals[labels]}')
+                lines.append(f"{self.name}_sum{{{label_str}}} {self._sums[labels]}")
+                lines.append(f"{self.name}_count{{{label_str}}} {self._totals[labels]}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram("pubvis_request_duration_seconds", "Time spent handling a request", ("method", "route", "status"))
+REQUEST_DB_QUERIES = Histogram(
+    "pubvis_request_db_queries", "Number of DB queries per request", ("route",), (0, 1, 2, 5, 10, 20, 50, 100, 250)
+)
+REQUEST_DB_DURATION = Histogram("pubvis_request_db_duration_seconds", "Time spent on DB queries per request", ("route",))
+STAGE_DURATION = Histogram("pubvis_stage_duration_seconds", "Time spent in individual processing stages", ("stage",))
+
+ALL_METRICS = (REQUEST_DURATION, REQUEST_DB_QUERIES, REQUEST_DB_DURATION, STAGE_DURATION)
+
+
+@dataclass
+class RequestStats:
+    """Timings collected while handling a single request (or a single setup_db run)"""
+
+    queries: int = 0
+    query_time: float = 0.0
+    stages: dict[str, float] = field(default_factory=dict)
+
+    def add_stage(self, stage: str, duration: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{stage}={duration:.3f}s" for stage, duration in self.stages.items())
+        return f"{stages}; db: {self.queries} queries in {self.query_time:.3f}s"
+
+
+_current_stats: ContextVar[RequestStats | None] = ContextVar("pubvis_request_stats", default=None)
+
+
+@contextmanager
+def track() -> Iterator[RequestStats]:
+    """Collect query counts and stage timings for everything executed within this context"""
+    instrument_sqlalchemy()
+    stats = RequestStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a processing stage (e.g. 'vectorize', 'knn', 'hydrate') of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.add_stage(stage, duration)
+        if METRICS_ENABLED:
+            STAGE_DURATION.observe(duration, stage)
+
+
+# SQLAlchemy event hooks - registered on the Engine class so they cover every engine
+_instrumented = False
+_instrument_lock = threading.Lock()
+
+
+# the start time is kept on the execution context, which is discarded after every statement (even if it fails)
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.pubvis_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "pubvis_query_start", None)
+    stats = _current_stats.get()
+    if stats is not None and start is not None:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+
+def instrument_sqlalchemy():
+    global _instrumented
+    with _instrument_lock:
+        if not _instrumented:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _instrumented = True
+
+
+def _route_label(scope) -> str:
+    # use the route template (e.g. /items/{item_id}) instead of the actual path to keep the label cardinality low
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "") or "/"
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+def _server_timing(stats: RequestStats, total: float) -> str:
+    entries = [f"{stage};dur={1000 * duration:.2f}" for stage, duration in stats.stages.items()]
+    entries.append(f"db;dur={1000 * stats.query_time:.2f}")
+    entries.append(f"total;dur={1000 * total:.2f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and DB query histograms per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (METRICS_ENABLED or TIMING_HEADERS):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if TIMING_HEADERS:
+                    total = time.perf_counter() - start
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-query-count", str(stats.queries).encode()))
+                    headers.append((b"server-timing", _server_timing(stats, total).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        with track() as stats:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if METRICS_ENABLED:
+                    route = _route_label(scope)
+                    REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], route, str(status))
+                    REQUEST_DB_QUERIES.observe(stats.queries, route)
+                    REQUEST_DB_DURATION.observe(stats.query_time, route)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in ALL_METRICS for line in metric.render()) + "\n"
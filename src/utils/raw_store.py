@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import islice
+from typing import BinaryIO, TextIO
+
+logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s", level=logging.INFO)
+
+# raw articles are stored as append-only JSON Lines shards (shard-00000.jsonl, ...) with one record per line;
+# next to every shard, an index (shard-00000.idx) contains one "item_id<TAB>byte offset" line per record
+SHARD_SIZE = 10000
+
+
+def shard_paths(raw_dir: str) -> list[str]:
+    return sorted(glob(os.path.join(raw_dir, "shard-*.jsonl")))
+
+
+def _index_path(shard_path: str) -> str:
+    return shard_path.removesuffix(".jsonl") + ".idx"
+
+
+def load_index(raw_dir: str) -> dict[str, tuple[str, int]]:
+    """Map the item_id of every stored record to its shard and byte offset"""
+    index = {}
+    for shard_path in shard_paths(raw_dir):
+        if not os.path.exists(_index_path(shard_path)):
+            continue
+        with open(_index_path(shard_path)) as f:
+            for line in f:
+                # skip incomplete lines (e.g. if a previous download was killed while writing)
+                if not line.endswith("\n"):
+                    continue
+                item_id, _, offset = line.rstrip("\n").partition("\t")
+                try:
+                    index[item_id] = (shard_path, int(offset))
+                except ValueError:
+                    logging.warning(f"[load_index]: skipping invalid index entry {line!r} in {_index_path(shard_path)}")
+    return index
+
+
+def read_record(index: dict[str, tuple[str, int]], item_id: str) -> dict:
+    """Random access to a single record using the offset index"""
+    shard_path, offset = index[item_id]
+    with open(shard_path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+def _truncate_partial_record(shard_path: str, chunk_size: int = 65536):
+    """Drop a partially written last line (e.g. if a previous download was killed while writing)"""
+    with open(shard_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if not end:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        # scan backwards for the end of the last complete record
+        pos = end
+        while pos > 0:
+            start = max(pos - chunk_size, 0)
+            f.seek(start)
+            i = f.read(pos - start).rfind(b"\n")
+            if i >= 0:
+                f.truncate(start + i + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+class ShardWriter:
+    """Append records to the shards in raw_dir, starting a new shard every `max_records` records"""
+
+    def __init__(self, raw_dir: str, max_records: int = SHARD_SIZE):
+        os.makedirs(raw_dir, exist_ok=True)
+        self.raw_dir = raw_dir
+        self.max_records = max_records
+        self.index = load_index(raw_dir)
+        self._shard: BinaryIO | None = None
+        self._index: TextIO | None = None
+        self._n_records = 0
+        # continue with the last shard if it still has space
+        paths = shard_paths(raw_dir)
+        if paths:
+            n_records = sum(1 for path, _ in self.index.values() if path == paths[-1])
+            if n_records < max_records:
+                self._open(paths[-1], n_records)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _open(self, shard_path: str, n_records: int = 0):
+        self.close()
+        # drop partially written lines, the index (written after the record) is repaired as well
+        for path in (shard_path, _index_path(shard_path)):
+            if os.path.exists(path):
+                _truncate_partial_record(path)
+        self._shard = open(shard_path, "ab")  # noqa: SIM115
+        self._index = open(_index_path(shard_path), "a")  # noqa: SIM115
+        self._n_records = n_records
+
+    def write(self, record: dict):
+        if self._shard is None or self._n_records >= self.max_records:
+            self._open(os.path.join(self.raw_dir, f"shard-{len(shard_paths(self.raw_dir)):05d}.jsonl"))
+        shard, index = self._shard, self._index
+        assert shard is not None and index is not None
+        offset = shard.tell()
+        shard.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+        shard.flush()
+        # the index is written after the record, i.e., it never points to incomplete records
+        index.write(f"{record['item_id']}\t{offset}\n")
+        index.flush()
+        self.index[record["item_id"]] = (shard.name, offset)
+        self._n_records += 1
+
+    def close(self):
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_shard(shard_path: str) -> list[dict]:
+    records = []
+    with open(shard_path, "rb") as f:
+        for i, line in enumerate(f):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning(f"[read_shard]: skipping invalid record in line {i} of {shard_path}")
+    return records
+
+
+def iter_records(raw_dir: str, n_jobs: int | None = None) -> Iterator[dict]:
+    """
+    Stream all records stored in the shards in raw_dir (in a deterministic order)
+
+    The shards are parsed in parallel in a process pool with `n_jobs` workers (default: number of CPUs).
+    Only a few shards per worker are parsed ahead, so at most these are held in memory besides what
+    the caller keeps. Since the parsed records still have to be unpickled in this process (which takes
+    about a third of the time of parsing the json), the speedup compared to n_jobs=1 is at most ~3x.
+    """
+    paths = shard_paths(raw_dir)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(paths) <= 1:
+        for shard_path in paths:
+            yield from _read_shard(shard_path)
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        remaining_paths = iter(paths)
+        pending = deque(executor.submit(_read_shard, path) for path in islice(remaining_paths, 2 * n_jobs))
+        while pending:
+            records = pending.popleft().result()
+            for path in islice(remaining_paths, 1):
+                pending.append(executor.submit(_read_shard, path))
+            yield from records
+            # don't keep the shard alive while waiting for the next one
+            del records
+
+
+def convert_json_dir(json_dir: str, raw_dir: str | None = None, max_records: int = SHARD_SIZE) -> int:
+    """One-shot conversion of a folder with one json file per article into shards (saved in the same folder by default)"""
+    n_converted = 0
+    with ShardWriter(raw_dir or json_dir, max_records) as writer:
+        for json_path in sorted(glob(os.path.join(json_dir, "*.json"))):
+            with open(json_path) as f:
+                record = json.load(f)
+            if record["item_id"] not in writer:
+                writer.write(record)
+                n_converted += 1
+    logging.info(f"[convert_json_dir]: converted {n_converted} articles; the json files in {json_dir} can now be deleted.")
+    return n_converted
+
+
+if __name__ == "__main__":
+    from src import SOURCE
+
+    convert_json_dir(f"raw_texts/{SOURCE}")
@@ -1,7 +1,9 @@
 import colorsys
+import datetime
 import json
 import logging
 import os
+import shutil
 from glob import glob
 
 import joblib
@@ -11,7 +13,10 @@ from sklearn.manifold import TSNE
 from sklearn.neighbors import NearestNeighbors
 from sqlmodel import Session
 
-from src.db import Item, Similarity, create_db_and_tables, engine
+from src.artifacts import build_dir, prune_versions, version_dir, write_manifest
+from src.db import Item, Similarity, create_items_db, get_engine
+from src.metrics import timed, track
+from src.utils.raw_store import iter_records, shard_paths
 
 logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s", level=logging.INFO)
 
@@ -36,46 +41,88 @@ def _item_data_to_json(item_data):
     return item_json
 
 
-def setup_db(source="pubmed"):
-    """Populate database and create artifacts based on given jsons"""
-    # load all jsons
-    logging.info("[setup_db]: loading jsons")
+def _load_items_data(raw_dir, n_jobs=None):
+    if shard_paths(raw_dir):
+        if glob(os.path.join(raw_dir, "*.json")):
+            logging.warning(
+                f"[setup_db]: ignoring individual json files in {raw_dir} (convert them with raw_store.py if needed)"
+            )
+        # an article might have been appended to the shards twice if a download was interrupted - keep the last one
+        return list({item_data["item_id"]: item_data for item_data in iter_records(raw_dir, n_jobs)}.values())
+    # fall back on the previous format with one json file per article
     items_data = []
-    for json_path in glob(f"raw_texts/{source}/*.json"):
+    for json_path in glob(os.path.join(raw_dir, "*.json")):
         with open(json_path) as f:
             items_data.append(json.load(f))
+    return items_data
+
+
+def setup_db(source="pubmed", keep_versions=3, n_jobs=None):
+    """
+    Populate database and create artifacts based on the downloaded articles
+
+    Everything is written into a new build folder, which is only moved to the versions once it is complete
+    (and deleted if the build fails); then the manifest is switched over to it, so a running app can pick up
+    the new version without serving partially written files.
+    Users and their ratings are not part of a version, they are kept in a separate DB shared by all versions.
+    """
+    version = datetime.datetime.now(tz=datetime.UTC).strftime("%Y%m%d-%H%M%S-%f")
+    # never write into an existing (possibly active) version folder
+    os.makedirs(build_dir(source, version), exist_ok=False)
+    try:
+        with track() as stats:
+            _setup_db(source, build_dir(source, version), n_jobs)
+        os.makedirs(os.path.dirname(version_dir(source, version)), exist_ok=True)
+        os.replace(build_dir(source, version), version_dir(source, version))
+    except BaseException:
+        shutil.rmtree(build_dir(source, version), ignore_errors=True)
+        raise
+    logging.info(f"[setup_db]: stage breakdown: {stats.summary()}")
+    write_manifest(source, version)
+    logging.info(f"[setup_db]: switched to version {version}")
+    for old_version in prune_versions(source, keep_versions):
+        logging.info(f"[setup_db]: removed old version {old_version}")
+
+
+def _setup_db(source, out_dir, n_jobs):
+    # load all articles
+    logging.info("[setup_db]: loading articles")
+    with timed("load"):
+        items_data = _load_items_data(f"raw_texts/{source}", n_jobs)
 
     # create tf-idf features from title + description
     logging.info("[setup_db]: creating tf-idf features")
     item_texts = [f"{i['title']}\n{i['description']}" for i in items_data]
     vectorizer = TfidfVectorizer(strip_accents="unicode")
-    X = vectorizer.fit_transform(item_texts)
+    with timed("vectorize"):
+        X = vectorizer.fit_transform(item_texts)
 
     # create t-sne embedding to get coordinates for visualization
     logging.info("[setup_db]: computing embeddings")
-    X_kpca = KernelPCA(n_components=100, kernel="linear").fit_transform(X)
-    X_tsne = TSNE(metric="cosine", verbose=0, random_state=42).fit_transform(X_kpca)
+    with timed("embed"):
+        X_kpca = KernelPCA(n_components=100, kernel="linear").fit_transform(X)
+        X_tsne = TSNE(metric="cosine", verbose=0, random_state=42).fit_transform(X_kpca)
 
     # create search tree for similarity search in app
     logging.info("[setup_db]: identifying nearest neighbors")
     n_neighbors = 51
     nn = NearestNeighbors(n_neighbors=n_neighbors, metric="cosine")
-    nn.fit(X)
-    # additionally save item ids together with tree so we can map the index back to our ids
-    nn.item_ids_ = [i["item_id"] for i in items_data]
-    # get nearest neighbors for all our items to cache them in the DB
-    nn_distances, nn_idx = nn.kneighbors(X)
+    with timed("knn"):
+        nn.fit(X)
+        # additionally save item ids together with tree so we can map the index back to our ids
+        nn.item_ids_ = [i["item_id"] for i in items_data]
+        # get nearest neighbors for all our items to cache them in the DB
+        nn_distances, nn_idx = nn.kneighbors(X)
 
     # save vectorizer and search tree for endpoint later
     logging.info("[setup_db]: saving artifacts")
-    os.makedirs(f"assets/{source}", exist_ok=True)
-    joblib.dump(vectorizer, f"assets/{source}/vectorizer.pkl")
-    joblib.dump(nn, f"assets/{source}/nn_tree.pkl")
+    with timed("save_artifacts"):
+        joblib.dump(vectorizer, os.path.join(out_dir, "vectorizer.pkl"))
+        joblib.dump(nn, os.path.join(out_dir, "nn_tree.pkl"))
 
     # save item json for frontend
     logging.info("[setup_db]: saving jsons for frontend")
-    os.makedirs(f"assets/{source}", exist_ok=True)
-    with open(f"assets/{source}/item_info.json", "w") as f:
+    with timed("save_jsons"), open(os.path.join(out_dir, "item_info.json"), "w") as f:
         f.write(json.dumps({i["item_id"]: _item_data_to_json(i) for i in items_data}))
 
     # for colors and coordinates we first need to create a color map based on the keywords
@@ -95,13 +142,14 @@ def setup_db(source="pubmed"):
         }
         for i, idata in enumerate(items_data)
     ]
-    with open(f"assets/{source}/xyc.json", "w") as f:
+    with timed("save_jsons"), open(os.path.join(out_dir, "xyc.json"), "w") as f:
         f.write(json.dumps(xyc_json))
 
     # save items with all additional fields in DB
     logging.info("[setup_db]: create database and add items")
-    create_db_and_tables()
-    with Session(engine) as session:
+    engine = get_engine(out_dir)
+    create_items_db(engine)
+    with timed("insert"), Session(engine) as session:
         for i, item_data in enumerate(items_data):
             # create item with basic info
             item = Item(**item_data)
@@ -113,6 +161,7 @@ def setup_db(source="pubmed"):
             session.add(item)
             session.add_all(similar_items)
         session.commit()
+    engine.dispose()
 
 
 if __name__ == "__main__":
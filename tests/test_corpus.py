@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+import time
+
+import joblib
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlmodel import Session, SQLModel
+
+from src.artifacts import prune_versions, read_manifest, version_dir, write_manifest
+from src.corpus import CORPORA, Corpus
+from src.db import Item, Rating, User, create_items_db, create_users_db, get_engine, get_users_engine
+from src.main import app
+from src.utils import setup
+
+
+def _create_version(source: str, version: str, item_ids: tuple[str, ...] = ()):
+    os.makedirs(version_dir(source, version))
+    joblib.dump({"version": version}, os.path.join(version_dir(source, version), "vectorizer.pkl"))
+    joblib.dump({"version": version}, os.path.join(version_dir(source, version), "nn_tree.pkl"))
+    engine = get_engine(version_dir(source, version))
+    create_items_db(engine)
+    with Session(engine) as session:
+        for item_id in item_ids:
+            session.add(Item(item_id=item_id, title=f"title {item_id}", keywords="test", description="", pub_date="2020-01-01"))
+        session.commit()
+    engine.dispose()
+    write_manifest(source, version)
+
+
+@pytest.fixture(autouse=True)
+def assets_dir(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    # all artifacts are read from/written to assets/ relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def test_hot_reload():
+    _create_version("test", "v1")
+    corpus = Corpus("test")
+    assert corpus.current.version == "v1"
+    assert not corpus.reload_if_changed()
+
+    # a request started before the new version is available keeps using the old one
+    old_version = corpus.acquire()
+    assert old_version.vectorizer == {"version": "v1"}
+    _create_version("test", "v2")
+    assert corpus.reload_if_changed()
+    assert corpus.current.version == "v2"
+    assert corpus.current.info()["loaded"] == ["nn_tree", "vectorizer"]
+    assert old_version.nn_tree == {"version": "v1"}
+    # the old version is only closed once its last request is done
+    old_version.release()
+    assert old_version.info()["loaded"] == []
+
+    # broken versions are not swapped in
+    os.makedirs(version_dir("test", "v3"))
+    write_manifest("test", "v3")
+    assert not corpus.reload_if_changed()
+    assert corpus.current.version == "v2"
+
+
+def test_lazy_loading_does_not_block(monkeypatch: pytest.MonkeyPatch):
+    _create_version("test", "v1")
+    corpus = Corpus("test")
+    started, finish = threading.Event(), threading.Event()
+
+    def slow_load(path):
+        started.set()
+        finish.wait(5)
+        return {"path": path}
+
+    monkeypatch.setattr(joblib, "load", slow_load)
+    version = corpus.acquire()
+    loader = threading.Thread(target=lambda: version.nn_tree)
+    loader.start()
+    assert started.wait(5)
+    # other requests can acquire (and release) the version while the NN index is still being loaded
+    start = time.perf_counter()
+    corpus.acquire().release()
+    assert time.perf_counter() - start < 1
+    finish.set()
+    loader.join()
+    version.release()
+
+
+def test_legacy_layout():
+    # without a manifest, the artifacts are expected directly in assets/{source}
+    os.makedirs("assets/test")
+    joblib.dump({"version": None}, "assets/test/vectorizer.pkl")
+    corpus = Corpus("test")
+    assert read_manifest("test") is None
+    assert corpus.current.version is None
+    assert corpus.current.vectorizer == {"version": None}
+
+
+def test_prune_versions():
+    for version in ("v1", "v2", "v3", "v4"):
+        _create_version("test", version)
+    assert prune_versions("test", keep=2) == ["v1", "v2"]
+    assert sorted(os.listdir("assets/test/versions")) == ["v3", "v4"]
+    assert read_manifest("test")["version"] == "v4"
+
+
+def test_failed_build_not_kept(monkeypatch: pytest.MonkeyPatch):
+    for version in ("v1", "v2"):
+        _create_version("test", version)
+
+    def failing_setup_db(source, out_dir, n_jobs):
+        joblib.dump({}, os.path.join(out_dir, "vectorizer.pkl"))
+        raise RuntimeError("build failed")
+
+    monkeypatch.setattr(setup, "_setup_db", failing_setup_db)
+    with pytest.raises(RuntimeError):
+        setup.setup_db("test", keep_versions=2)
+    # the partial build is removed and doesn't count as one of the versions to keep
+    assert sorted(os.listdir("assets/test")) == ["manifest.json", "versions"]
+    assert sorted(os.listdir("assets/test/versions")) == ["v1", "v2"]
+    assert prune_versions("test", keep=2) == []
+    assert read_manifest("test")["version"] == "v2"
+
+
+def test_ratings_kept_across_versions(monkeypatch: pytest.MonkeyPatch):
+    _create_version("test", "v1", ("1", "2"))
+    corpus = Corpus("test")
+    create_users_db(corpus.users_engine, "test")
+    monkeypatch.setitem(CORPORA, "test", corpus)
+    client = TestClient(app)
+
+    response = client.post("/corpora/test/ratings", json={"item_id": "1", "user_id": "u1"})
+    assert response.status_code == 200
+    # a request still running on v1 while v2 is swapped in
+    old_version = corpus.acquire()
+    _create_version("test", "v2", ("1", "2"))
+    assert corpus.reload_if_changed()
+    with Session(binds=old_version.binds) as session:
+        session.add(Rating(user_id="u1", item_id="2", rating=1.0))
+        session.commit()
+    old_version.release()
+    # ratings given after the new version was built but before the server switched over
+    _create_version("test", "v3", ("1", "2"))
+    response = client.post("/corpora/test/ratings", json={"item_id": "1", "user_id": "u2"})
+    assert response.status_code == 200
+    assert corpus.reload_if_changed()
+    prune_versions("test", keep=1)
+
+    with Session(binds=corpus.current.binds) as session:
+        assert session.get(Rating, ("u1", "1"))
+        assert session.get(Rating, ("u1", "2"))
+        assert session.get(Rating, ("u2", "1"))
+    response = client.get("/corpora/test/users/u1/recommendations")
+    assert response.status_code == 200
+
+
+def test_legacy_users_migrated():
+    # before users and items were split, both were stored in assets/{source}/database.db
+    os.makedirs("assets/test")
+    legacy_engine = get_engine("assets/test")
+    SQLModel.metadata.create_all(legacy_engine)
+    with Session(legacy_engine) as session:
+        session.add(User(user_id="u1"))
+        session.add(Rating(user_id="u1", item_id="1", rating=1.0))
+        session.commit()
+    legacy_engine.dispose()
+    corpus = Corpus("test")
+    create_users_db(corpus.users_engine, "test")
+    # creating the users DB again doesn't copy the ratings twice
+    create_users_db(corpus.users_engine, "test")
+    with Session(binds=corpus.current.binds) as session:
+        assert session.get(Rating, ("u1", "1"))
+
+
+def test_legacy_rating_foreign_key_dropped():
+    # an external users DB (DATABASE_URL) still contains the items and ratings referencing them
+    os.makedirs("assets/test")
+    users_engine = get_users_engine("test")
+    event.listen(users_engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    with users_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE user (user_id VARCHAR NOT NULL PRIMARY KEY)"))
+        conn.execute(text("CREATE TABLE item (item_id VARCHAR NOT NULL PRIMARY KEY)"))
+        conn.execute(
+            text(
+                "CREATE TABLE rating (user_id VARCHAR NOT NULL REFERENCES user (user_id), "
+                "item_id VARCHAR NOT NULL REFERENCES item (item_id), rating FLOAT NOT NULL, "
+                "timestamp DATETIME NOT NULL, PRIMARY KEY (user_id, item_id))"
+            )
+        )
+        conn.execute(text("INSERT INTO user VALUES ('u1')"))
+        conn.execute(text("INSERT INTO item VALUES ('1')"))
+        conn.execute(text("INSERT INTO rating VALUES ('u1', '1', 1.0, '2020-01-01 00:00:00')"))
+    create_users_db(users_engine, "test")
+    # ratings for items that are not in the users DB are accepted and existing ones are kept
+    with Session(users_engine) as session:
+        session.add(Rating(user_id="u1", item_id="2", rating=1.0))
+        session.commit()
+        assert session.get(Rating, ("u1", "1"))
+        assert session.get(Rating, ("u1", "2"))
+    users_engine.dispose()
+
+
+def test_corpora_isolated(monkeypatch: pytest.MonkeyPatch):
+    # two corpora with their own DBs and asset folders, without overriding any dependencies
+    for source in ("a", "b"):
+        _create_version("test_" + source, "v1", (f"{source}1",))
+        with open(os.path.join(version_dir("test_" + source, "v1"), "item_info.json"), "w") as f:
+            json.dump({f"{source}1": {"title": f"title {source}1"}}, f)
+        corpus = Corpus("test_" + source)
+        create_users_db(corpus.users_engine, "test_" + source)
+        monkeypatch.setitem(CORPORA, "test_" + source, corpus)
+    client = TestClient(app)
+
+    for source, other in (("a", "b"), ("b", "a")):
+        response = client.get(f"/corpora/test_{source}/items/{source}1")
+        assert response.status_code == 200
+        assert response.json()["item_id"] == f"{source}1"
+        response = client.get(f"/corpora/test_{source}/items/{other}1")
+        assert response.status_code == 404
+        response = client.get(f"/corpora/test_{source}/static_json_item_info")
+        assert response.status_code == 200
+        assert list(response.json()) == [f"{source}1"]
+
+    # ratings end up in the users DB of the corpus they were given for
+    response = client.post("/corpora/test_a/ratings", json={"item_id": "a1", "user_id": "u1"})
+    assert response.status_code == 200
+    response = client.post("/corpora/test_b/ratings", json={"item_id": "a1", "user_id": "u1"})
+    assert response.status_code == 404
+    with Session(binds=CORPORA["test_a"].current.binds) as session:
+        assert session.get(Rating, ("u1", "a1"))
+    with Session(binds=CORPORA["test_b"].current.binds) as session:
+        assert not session.get(Rating, ("u1", "a1"))
@@ -2,9 +2,13 @@ import datetime
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine, select
 from sqlmodel.pool import StaticPool
 
+from src import SOURCES, metrics
+from src.corpus import CORPORA
 from src.db import Item
 from src.main import app, get_session
 
@@ -184,3 +188,116 @@ def test_keyword_search(session: Session, client: TestClient):
     assert response.status_code == 200
     json_response = response.json()
     assert len(json_response) == 0
+
+
+def test_metrics(session: Session, client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    # metrics are disabled by default
+    response = client.get("/metrics")
+    assert response.status_code == 404
+
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "TIMING_HEADERS", True)
+    for metric in metrics.ALL_METRICS:
+        metric.reset()
+    session.add(Item(item_id="1", title="title 1", keywords="test", description="Abstract of item 1", pub_date="2020-01-01"))
+    session.commit()
+
+    # timing headers report the DB queries and stages of this request
+    response = client.get("/items/1/similar")
+    assert response.status_code == 200
+    assert int(response.headers["x-query-count"]) >= 1
+    assert "hydrate;dur=" in response.headers["server-timing"]
+    assert "total;dur=" in response.headers["server-timing"]
+
+    # histograms are labeled by route template, not the actual path
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert (
+        'pubvis_request_duration_seconds_count{method="GET",route="/items/{item_id}/similar",status="200"} 1' in response.text
+    )
+    assert 'pubvis_stage_duration_seconds_count{stage="hydrate"} 1' in response.text
+
+
+def test_query_stats(session: Session):
+    with metrics.track() as stats:
+        # failing statements don't leave any state behind on the (pooled) connection
+        with pytest.raises(OperationalError):
+            session.exec(text("SELECT * FROM does_not_exist"))
+        session.rollback()
+        session.exec(select(Item)).all()
+    assert stats.queries == 1
+    assert not any(k.startswith("pubvis") for k in session.connection().info)
+
+
+def test_corpora(session: Session, client: TestClient):
+    session.add(Item(item_id="1", title="title 1", keywords="test", description="Abstract of item 1", pub_date="2020-01-01"))
+    session.commit()
+
+    # by default, only a single corpus is served, nothing is loaded yet
+    response = client.get("/corpora")
+    assert response.status_code == 200
+    json_response = response.json()
+    assert [c["source"] for c in json_response] == [SOURCES[0]]
+    assert json_response[0]["loaded"] == []
+
+    # the default corpus is available with and without prefix
+    response = client.get(f"/corpora/{SOURCES[0]}/items/1")
+    assert response.status_code == 200
+    assert response.json()["item_id"] == "1"
+    response = client.get("/items/1")
+    assert response.status_code == 200
+    assert response.json()["item_id"] == "1"
+
+    # unknown corpora
+    response = client.get("/corpora/unknown/items/1")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Corpus not found"
+
+
+def test_caching(session: Session, client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    session.add(Item(item_id="1", title="title 1", keywords="test", description="Abstract of item 1", pub_date="2020-01-01"))
+    session.commit()
+
+    # without a build of the corpus, there are no validators
+    response = client.get("/items/1")
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("public")
+    assert "etag" not in response.headers
+
+    version = CORPORA[SOURCES[0]].current
+    monkeypatch.setattr(version, "version", "v1")
+    monkeypatch.setattr(version, "last_modified", datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC))
+    response = client.get("/items/1")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert response.headers["last-modified"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    # ETags differ between items
+    assert client.get("/items/1/similar").headers["etag"] != etag
+
+    # conditional requests
+    response = client.get("/items/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert not response.content
+    response = client.get("/items/1", headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == 304
+    response = client.get("/items/1", headers={"If-Modified-Since": "Tue, 02 Jan 2024 00:00:00 GMT"})
+    assert response.status_code == 304
+    response = client.get("/items/1", headers={"If-Modified-Since": "Sun, 31 Dec 2023 00:00:00 GMT"})
+    assert response.status_code == 200
+    # "*" would also match items that don't exist
+    response = client.get("/items/2", headers={"If-None-Match": "*"})
+    assert response.status_code == 404
+
+    # a new build invalidates the ETags
+    monkeypatch.setattr(version, "version", "v2")
+    response = client.get("/items/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    # personalized and random items are not cached by shared caches
+    response = client.get("/users/666/recommendations")
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert "etag" not in response.headers
+    response = client.get("/items/random")
+    assert response.headers["cache-control"] == "no-store"
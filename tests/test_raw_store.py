@@ -0,0 +1,123 @@
+import json
+import os
+
+from src.utils.raw_store import (
+    ShardWriter,
+    _truncate_partial_record,
+    convert_json_dir,
+    iter_records,
+    load_index,
+    read_record,
+    shard_paths,
+)
+from src.utils.setup import _load_items_data
+
+
+def _record(i: int) -> dict:
+    return {"item_id": str(i), "title": f"title {i}", "description": f"Abstract of item {i} with ümlauts"}
+
+
+def test_shard_writer(tmp_path):
+    raw_dir = str(tmp_path)
+    with ShardWriter(raw_dir, max_records=3) as writer:
+        for i in range(5):
+            writer.write(_record(i))
+        assert "4" in writer
+        assert "5" not in writer
+    assert len(shard_paths(raw_dir)) == 2
+
+    # appending continues with the last (not yet full) shard
+    with ShardWriter(raw_dir, max_records=3) as writer:
+        assert len(writer) == 5
+        writer.write(_record(5))
+        writer.write(_record(6))
+    assert len(shard_paths(raw_dir)) == 3
+
+    # random access via the offset index
+    index = load_index(raw_dir)
+    assert read_record(index, "4") == _record(4)
+    # streaming all records (in parallel and sequentially)
+    assert list(iter_records(raw_dir, n_jobs=2)) == [_record(i) for i in range(7)]
+    assert list(iter_records(raw_dir, n_jobs=1)) == [_record(i) for i in range(7)]
+
+
+def test_partially_written_record(tmp_path):
+    raw_dir = str(tmp_path)
+    with ShardWriter(raw_dir) as writer:
+        writer.write(_record(0))
+    # simulate a download that was killed while writing the next record
+    with open(shard_paths(raw_dir)[0], "ab") as f:
+        f.write(b'{"item_id": "1", "tit')
+    assert list(iter_records(raw_dir)) == [_record(0)]
+    with ShardWriter(raw_dir) as writer:
+        writer.write(_record(1))
+    assert list(iter_records(raw_dir)) == [_record(0), _record(1)]
+    assert read_record(load_index(raw_dir), "1") == _record(1)
+
+    # partial records longer than the chunks scanned backwards for the last complete record
+    with open(shard_paths(raw_dir)[0], "ab") as f:
+        f.write(b'{"item_id": "2", "title": "a long partial record')
+    _truncate_partial_record(shard_paths(raw_dir)[0], chunk_size=4)
+    assert list(iter_records(raw_dir)) == [_record(0), _record(1)]
+    # ... also if there is no complete record at all
+    with open(os.path.join(raw_dir, "partial.jsonl"), "wb") as f:
+        f.write(b'{"item_id": "0"')
+    _truncate_partial_record(os.path.join(raw_dir, "partial.jsonl"), chunk_size=4)
+    assert os.path.getsize(os.path.join(raw_dir, "partial.jsonl")) == 0
+
+
+def test_partially_written_index(tmp_path):
+    raw_dir = str(tmp_path)
+    with ShardWriter(raw_dir) as writer:
+        writer.write(_record(0))
+        writer.write(_record(1))
+    # simulate a download that was killed while writing the index entry of the last record
+    index_path = shard_paths(raw_dir)[0].removesuffix(".jsonl") + ".idx"
+    with open(index_path) as f:
+        lines = f.readlines()
+    with open(index_path, "w") as f:
+        f.write(lines[0] + lines[1][:3])
+    # the record without a (complete) index entry is not known, i.e., it is downloaded again
+    assert set(load_index(raw_dir)) == {"0"}
+    with ShardWriter(raw_dir) as writer:
+        assert "1" not in writer
+        writer.write(_record(1))
+        writer.write(_record(2))
+    index = load_index(raw_dir)
+    assert set(index) == {"0", "1", "2"}
+    assert [read_record(index, str(i)) for i in range(3)] == [_record(i) for i in range(3)]
+    # invalid entries are skipped
+    with open(index_path, "a") as f:
+        f.write("3\tnot an offset\n")
+    assert set(load_index(raw_dir)) == {"0", "1", "2"}
+
+
+def test_convert_json_dir(tmp_path):
+    json_dir = str(tmp_path)
+    for i in range(3):
+        with open(os.path.join(json_dir, f"{i}.json"), "w") as f:
+            json.dump(_record(i), f, indent=2)
+    assert convert_json_dir(json_dir) == 3
+    # converting again does not add any duplicates
+    assert convert_json_dir(json_dir) == 0
+    assert list(iter_records(json_dir)) == [_record(i) for i in range(3)]
+
+
+def test_load_items_data(tmp_path):
+    # previous format with one json file per article
+    json_dir = str(tmp_path / "json")
+    os.makedirs(json_dir)
+    for i in range(3):
+        with open(os.path.join(json_dir, f"{i}.json"), "w") as f:
+            json.dump(_record(i), f, indent=2)
+    assert sorted(_load_items_data(json_dir), key=lambda r: r["item_id"]) == [_record(i) for i in range(3)]
+
+    # shards with an article appended twice (e.g. after an interrupted download): the last one is kept
+    raw_dir = str(tmp_path / "raw")
+    with ShardWriter(raw_dir, max_records=2) as writer:
+        for i in range(3):
+            writer.write(_record(i))
+        writer.write({**_record(1), "title": "updated title"})
+    items_data = _load_items_data(raw_dir, n_jobs=2)
+    assert [r["item_id"] for r in items_data] == ["0", "1", "2"]
+    assert items_data[1]["title"] == "updated title"